@@ -9,95 +9,439 @@ from lldb_toybox.lib.value import Value, ValueSynthetic
 import lldb
 
 import re
+import struct
+
+from itertools import islice
+
+_CTRL_MSB_MASK = 0x8080808080808080
+
+# Policy template argument naming the kind of the container an iterator/node belongs to
+_POLICY_RE = re.compile(r"::(Node|Flat)Hash(Map|Set)Policy<")
+
+# Decoded (is_flat, is_map) policy kinds per typename
+_policy_kinds = dict()
+
+# Discovering slot types requires scanning through the member functions of large class
+#  templates, remember them per process and canonical typename of the containers and
+#  scanned classes
+_slot_ptr_types = dict()
+
+# The `value` member of flat map slots sits at the same offset in every slot, remember
+#  its location per process and slot type instead of looking it up for every element
+_slot_value_fields = dict()
+
+# Location of the `capacity_` and `size_` fields inside CommonFields, per process and its
+#  typename
+_counter_layouts = dict()
+
+_INTEGER_FORMATS = {4: 'I', 8: 'Q'}
+
+# Node handles hold an optional allocator, which is only engaged while they own a node. It
+#  is either absl::optional or an alias of std::optional, which name their flags differently
+_ENGAGED_FLAG_NAMES = ('engaged_', '__engaged_', '_M_engaged')
+
+# Member name paths leading to the engaged flag, per canonical typename of the optional
+_engaged_flag_paths = dict()
+
+def get_member_fields(record_t):
+	"""
+		Returns the data members of `record_t` the same way they can be looked up by name,
+		 including the ones of its base classes and anonymous members
+	"""
+	fields = list()
+
+	for index in range(0, record_t.GetNumberOfFields()):
+		field = record_t.GetFieldAtIndex(index)
+
+		if field.GetName():
+			fields.append(field)
+		else:
+			fields.extend(get_member_fields(field.GetType().GetCanonicalType()))
+
+	for index in range(0, record_t.GetNumberOfDirectBaseClasses()):
+		fields.extend(get_member_fields(record_t.GetDirectBaseClassAtIndex(index).GetType().GetCanonicalType()))
+
+	return fields
+
+def find_engaged_flag_path(optional_t, max_depth=4):
+	"""
+		Returns the member names leading to the engaged flag of an optional, or None if
+		 no such flag could be found. Implementations keep their flag in deep base class
+		 chains, those do not count towards the depth
+	"""
+	pending = [(optional_t.GetCanonicalType(), [])]
+
+	while pending:
+		record_t, path = pending.pop(0)
+		fields = get_member_fields(record_t)
+
+		for field in fields:
+			if field.GetName() in _ENGAGED_FLAG_NAMES:
+				return path + [field.GetName()]
+
+		if len(path) + 1 < max_depth:
+			pending.extend((field.GetType().GetCanonicalType(), path + [field.GetName()]) for field in fields)
+
+	return None
+
+def get_slot_ptr_type(key):
+	slot_ptr_t = _slot_ptr_types.get(key)
+
+	# Types of unloaded modules become invalid, those have to be looked up again
+	if slot_ptr_t is not None and not slot_ptr_t.IsValid():
+		return None
+
+	return slot_ptr_t
+
+def get_policy_kind(typename):
+	"""Returns the (is_flat, is_map) kind of the policy named by `typename`"""
+	kind = _policy_kinds.get(typename)
+
+	if kind is None:
+		match = _POLICY_RE.search(typename)
+		kind = (match.group(1) == 'Flat', match.group(2) == 'Map')
+
+		_policy_kinds[typename] = kind
+
+	return kind
+
+def iterate_full_slots(ctrl_arr):
+	"""
+		Yields the indices of full slots in the control byte array. A slot is full
+		 if the high bit of its control byte is clear, empty/deleted/sentinel bytes
+		 all have it set.
+
+		Like Abseil's own group matching the bytes are tested 8 at a time, so whole
+		 groups of non-full slots can be skipped with a single test.
+	"""
+	words = len(ctrl_arr) // 8
+
+	for word_index, word in enumerate(struct.unpack_from(f'<{words}Q', ctrl_arr)):
+		full = ~word & _CTRL_MSB_MASK
+		base = word_index * 8
+
+		while full:
+			bit = full & -full
+			full ^= bit
+
+			yield base + ((bit.bit_length() - 1) >> 3)
+
+	# Control array length is not necessarily a multiple of 8
+	for index in range(words * 8, len(ctrl_arr)):
+		if not ctrl_arr[index] & 0x80:
+			yield index
 
 class AbseilHashContainer(IterableContainer):
+	__slots__ = ('valobj', 'typename', 'is_flat', 'is_map', 'get_elements', 'slot_ptr_t', 'slot_error', 'value_offset', 'value_t', 'common', 'capacity', 'size')
+
 	def __init__(self, valobj):
 		self.valobj = canonize_synthetic_valobj(valobj)
 
 		# Many flat_hash_... types are implemented with inheritance from raw_hash_set, and
 		#  only differ in policy template parameters. As such much of the code can be shared
-		#  between them. Determine which type we represent
+		#  between them. Determine which type we represent, only looking at the template name
+		#  as the arguments may name other containers
 		typename = self.valobj.GetType().GetCanonicalType().GetUnqualifiedType().GetName()
-		match = re.search(r"absl::[^:]+::(flat|node)_hash_(map|set)", typename)
+		template = typename.partition('<')[0]
 
-		self.is_flat = match.group(1) == 'flat'
-		self.is_map = match.group(2) == 'map'
+		self.is_flat = template.endswith(('flat_hash_map', 'flat_hash_set'))
+		self.is_map = template.endswith('_hash_map')
+
+		# Each variant stores its elements in slots differently, pick the matching accessor
+		#  once instead of branching on the variant for every slot
+		if self.is_flat:
+			self.get_elements = self.get_flat_map_elements if self.is_map else self.get_flat_set_elements
+		else:
+			self.get_elements = self.get_node_elements
 
-		# The underlying hashtable stores elements in "slots", whose type is difficult to obtain.. at the time of
-		#  writing, SB API does not let us get the typedefs in the policy template argument that would make this
-		#  much simpler/robust. (https://discourse.llvm.org/t/traversing-member-types-of-a-type/72452/12)
+		# Slot types are only needed for iterating, which summaries never do
+		self.typename = typename
 		self.slot_ptr_t = None
+		self.slot_error = None
+
+		self.capacity = None
+		self.size = None
+
+		# Grab common member variables from compressed tuple
+		self.common = self.valobj.GetChildMemberWithName('settings_').GetChildAtIndex(0).GetChildAtIndex(0).GetChildMemberWithName('value')
+
+	def resolve_slot_type(self):
+		"""Resolves the slot layout on first use, returns an error if that is not possible"""
+		if self.slot_ptr_t is not None or self.slot_error is not None:
+			return self.slot_error
+
+		# The underlying hashtable stores elements in "slots", whose type is difficult to obtain. Most of
+		#  the containers seen are of the same few types, so try looking them up by our own name first
+		key = get_type_scoped_key(self.valobj, self.typename)
+		slot_ptr_t = get_slot_ptr_type(key)
+
+		if slot_ptr_t is None:
+			slot_ptr_t = self.find_slot_ptr_type(self.valobj.GetType())
+
+			if slot_ptr_t is None:
+				self.slot_error = "Unable to determine the slot type"
+				return self.slot_error
+
+			_slot_ptr_types[key] = slot_ptr_t
+
+		if self.is_flat and self.is_map:
+			field = self.get_slot_value_field(slot_ptr_t.GetPointeeType())
+
+			if field is None:
+				self.slot_error = "Unable to locate the value within slots"
+				return self.slot_error
+
+			self.value_offset, self.value_t = field
+
+		self.slot_ptr_t = slot_ptr_t
+
+	def find_slot_ptr_type(self, container_t):
+		# At the time of writing, SB API does not let us get the typedefs in the policy template argument
+		#  that would make this much simpler/robust. (https://discourse.llvm.org/t/traversing-member-types-of-a-type/72452/12)
 
 		# Drilldown to the root class, which will be raw_hash_set<>
-		root = self.valobj.GetType()
+		root = container_t
 
 		while root.GetNumberOfDirectBaseClasses() != 0:
 			root = root.GetDirectBaseClassAtIndex(0).GetType()
 
-		# Obtain `raw_hash_set<>::iterator` from `raw_hash_set<>::begin()`
-		iterator = None
+		key = get_type_scoped_key(self.valobj, root.GetCanonicalType().GetName())
 
-		for index in range(0, root.GetNumberOfMemberFunctions()):
-			func = root.GetMemberFunctionAtIndex(index)
+		slot_ptr_t = get_slot_ptr_type(key)
 
-			if func.GetName() == 'begin':
-				iterator = func.GetReturnType()
-				break
+		if slot_ptr_t is None:
+			# Obtain `raw_hash_set<>::iterator` from `raw_hash_set<>::begin()`
+			iterator = None
 
-		# Obtain `raw_hash_set<>::slot*` from `raw_hash_set<>::iterator::slot()`
-		for index in range(0, iterator.GetNumberOfMemberFunctions()):
-			func = iterator.GetMemberFunctionAtIndex(index)
+			for index in range(0, root.GetNumberOfMemberFunctions()):
+				func = root.GetMemberFunctionAtIndex(index)
 
-			if func.GetName() == "slot":
-				self.slot_ptr_t = func.GetReturnType()
-				break
+				if func.GetName() == 'begin':
+					iterator = func.GetReturnType()
+					break
 
-		# Grab common member variables from compressed tuple
-		self.common = self.valobj.GetChildMemberWithName('settings_').GetChildAtIndex(0).GetChildAtIndex(0).GetChildMemberWithName('value')
+			if iterator is None:
+				return None
+
+			# Obtain `raw_hash_set<>::slot*` from `raw_hash_set<>::iterator::slot()`
+			for index in range(0, iterator.GetNumberOfMemberFunctions()):
+				func = iterator.GetMemberFunctionAtIndex(index)
+
+				if func.GetName() == "slot":
+					slot_ptr_t = func.GetReturnType()
+					break
+
+			if slot_ptr_t is None:
+				return None
+
+			_slot_ptr_types[key] = slot_ptr_t
+
+		return slot_ptr_t
+
+	def get_slot_value_field(self, slot_t):
+		key = get_type_scoped_key(self.valobj, slot_t.GetCanonicalType().GetName())
+		field = _slot_value_fields.get(key)
+
+		# Types of unloaded modules become invalid, those have to be looked up again
+		if field is None or not field[1].IsValid():
+			field = None
+
+			slot_t = slot_t.GetCanonicalType()
+
+			for index in range(0, slot_t.GetNumberOfFields()):
+				member = slot_t.GetFieldAtIndex(index)
+
+				if member.GetName() == 'value':
+					field = (member.GetOffsetInBytes(), member.GetType())
+					break
+
+			_slot_value_fields[key] = field
+
+		return field
+
+	def get_flat_map_elements(self, slot_arr, indices):
+		# Bind everything used by the loop up front, these are looked up for every slot otherwise
+		create_value = self.valobj.CreateValueFromAddress
+		address_of = slot_arr.address_of
+		value_offset = self.value_offset
+		value_t = self.value_t
+
+		return [create_value(f'[{index}]', address_of(index) + value_offset, value_t) for index in indices]
+
+	@staticmethod
+	def get_flat_set_elements(slot_arr, indices):
+		return [slot_arr[index] for index in indices]
+
+	@staticmethod
+	def get_node_elements(slot_arr, indices):
+		return [slot_arr[index].Dereference() for index in indices]
+
+	def get_counter_layout(self, common_t):
+		"""
+			Returns the (offset, length, fields) of the memory range holding both the
+			 capacity and the size, where fields are the (offset, struct format) pairs
+			 of the two counters within the range. Returns None if the counters can
+			 not be decoded from raw memory
+		"""
+		key = get_type_scoped_key(self.valobj, common_t.GetCanonicalType().GetName())
+
+		if key in _counter_layouts:
+			return _counter_layouts[key]
+
+		fields = dict()
+
+		for index in range(0, common_t.GetNumberOfFields()):
+			member = common_t.GetFieldAtIndex(index)
+
+			if member.GetName() in ('capacity_', 'size_'):
+				fields[member.GetName()] = (member.GetOffsetInBytes(), member.GetType().GetByteSize())
+
+		layout = None
+
+		if len(fields) == 2 and all(size in _INTEGER_FORMATS for _, size in fields.values()):
+			capacity_offset, capacity_size = fields['capacity_']
+			size_offset, size_size = fields['size_']
+
+			start = min(capacity_offset, size_offset)
+			end = max(capacity_offset + capacity_size, size_offset + size_size)
+
+			layout = (start, end - start, (
+				(capacity_offset - start, _INTEGER_FORMATS[capacity_size]),
+				(size_offset - start, _INTEGER_FORMATS[size_size]),
+			))
+
+		_counter_layouts[key] = layout
+
+		return layout
+
+	def read_counters(self):
+		# Both counters live next to each other in CommonFields, fetch them with a single read
+		layout = self.get_counter_layout(self.common.GetType())
+		address = self.common.GetLoadAddress()
+
+		if layout is not None and address != lldb.LLDB_INVALID_ADDRESS:
+			offset, length, fields = layout
+
+			error = lldb.SBError()
+			process = self.valobj.GetProcess()
+			data = process.ReadMemory(address + offset, length, error)
+
+			if error.Success():
+				order = '>' if process.GetByteOrder() == lldb.eByteOrderBig else '<'
+
+				self.capacity, self.size = [struct.unpack_from(order + fmt, data, field_offset)[0] for field_offset, fmt in fields]
+				return
+
+		self.capacity = self.common.GetChildMemberWithName('capacity_').GetValueAsUnsigned()
+		self.size = self.common.GetChildMemberWithName('size_').GetValueAsUnsigned()
 
 	def update(self):
-		pass
+		self.capacity = None
+		self.size = None
 
 	def get_capacity(self):
-		return self.common.GetChildMemberWithName('capacity_').GetValueAsUnsigned()
+		if self.capacity is None:
+			self.read_counters()
+
+		return self.capacity
 
 	def validate(self):
 		capacity = self.get_capacity()
 
-		if not is_pow2(capacity):
-			return f"Capacity {capacity} is not pow2"
+		# Capacities are always 2^k-1 so they can be used as masks, except for the
+		#  zero capacity of empty tables
+		if capacity != 0 and not is_pow2(capacity + 1):
+			return f"Capacity {capacity} is not 2^k-1"
 
 		size = self.get_size()
 
 		if capacity < size:
 			return f"Size {size} exceeds capacity {capacity}"
 
+		# Slots are only resolved once iterated, report if that did not work out previously
+		if self.slot_error is not None:
+			return self.slot_error
+
 	def get_size(self):
-		return self.common.GetChildMemberWithName('size_').GetValueAsUnsigned() >> 1
+		if self.size is None:
+			self.read_counters()
+
+		return self.size >> 1
 
-	def iterator(self):
+	def get_cache_key(self):
+		# Values without a load address all share the same key, never mix them up
+		if self.valobj.GetLoadAddress() == lldb.LLDB_INVALID_ADDRESS:
+			return None
+
+		return get_stop_scoped_key(self.valobj)
+
+	def find_full_slots(self, limit):
+		"""Returns the slot array, and the indices of at most `limit` full slots in it"""
 		capacity = self.get_capacity()
 
-		ctrl_arr = make_array_from_pointer(self.common.GetChildMemberWithName('control_'), capacity)
-		slot_arr = make_array_from_pointer(self.common.GetChildMemberWithName('slots_'), capacity, self.slot_ptr_t)
+		if capacity == 0:
+			return None
+
+		# Fetch all control bytes with a single memory read, going through the SB API
+		#  for every one of them is prohibitively slow for large tables
+		error = lldb.SBError()
+		ctrl_addr = self.common.GetChildMemberWithName('control_').GetValueAsUnsigned()
+		ctrl_arr = self.valobj.GetProcess().ReadMemory(ctrl_addr, capacity, error)
+
+		if error.Fail():
+			return None
 
-		for index in range(0, capacity):
-			ctrl = ctrl_arr.GetChildAtIndex(index).GetValueAsUnsigned()
+		if self.resolve_slot_type() is not None:
+			return None
 
-			if ctrl & 0x80:
-				continue
+		slot_arr = PointerArray(self.common.GetChildMemberWithName('slots_'), self.slot_ptr_t)
 
-			slot = slot_arr.GetChildAtIndex(index)
+		return slot_arr, list(islice(iterate_full_slots(ctrl_arr), limit))
 
-			if self.is_flat:
-				if self.is_map:
-					yield slot.GetChildMemberWithName('value')
-				else:
-					yield slot
+	def collect(self, limit):
+		full_slots = self.find_full_slots(limit)
+
+		if full_slots is None:
+			return []
+
+		# Only create values for full slots
+		return self.get_elements(*full_slots)
+
+	def collect_addresses(self, limit):
+		full_slots = self.find_full_slots(limit)
+
+		if full_slots is None or not full_slots[1]:
+			return None
+
+		slot_arr, indices = full_slots
+		address_of = slot_arr.address_of
+
+		if self.is_flat:
+			if self.is_map:
+				addresses = [address_of(index) + self.value_offset for index in indices]
+				element_t = self.value_t
 			else:
-				yield slot.Dereference()
+				addresses = [address_of(index) for index in indices]
+				element_t = slot_arr.element_t
+		else:
+			# Node slots only point to the elements
+			error = lldb.SBError()
+			read_pointer = self.valobj.GetProcess().ReadPointerFromMemory
+
+			addresses = list()
+			element_t = slot_arr.element_t.GetPointeeType()
+
+			for index in indices:
+				addresses.append(read_pointer(address_of(index), error))
+
+				if error.Fail():
+					return None
+
+		return addresses, self.valobj.CreateValueFromAddress(f'[{indices[0]}]', addresses[0], element_t)
 
 class AbseilHashContainerIteratorValue(Value):
+	__slots__ = ('valobj', 'is_flat', 'is_map')
+
 	def __init__(self, valobj):
 		self.valobj = canonize_synthetic_valobj(valobj)
 
@@ -109,10 +453,7 @@ class AbseilHashContainerIteratorValue(Value):
 			self.valobj = valobj.GetChildMemberWithName('inner_')
 
 		# Determining the container type is possible from the policy of the containing class
-		match = re.search(r"::(Node|Flat)Hash(Map|Set)Policy<", typename)
-
-		self.is_flat = match.group(1) == 'Flat'
-		self.is_map = match.group(2) == 'Map'
+		self.is_flat, self.is_map = get_policy_kind(typename)
 
 	def get(self):
 		if self.valobj.GetChildMemberWithName('ctrl_').GetValueAsUnsigned() == 0:
@@ -129,35 +470,62 @@ class AbseilHashContainerIteratorValue(Value):
 			return slot.Dereference()
 
 class AbseilHashContainerNodeValue(Value):
+	__slots__ = ('valobj', 'slot_ptr_t', 'is_flat', 'is_map')
+
 	def __init__(self, valobj):
 		self.valobj = canonize_synthetic_valobj(valobj)
 
 		# The same investigative work is required to obtain the policy's `slot_type`
-		self.slot_ptr_t = None
-
 		node_handle_base = self.valobj.GetType().GetDirectBaseClassAtIndex(0).GetType()
+		key = get_type_scoped_key(self.valobj, node_handle_base.GetCanonicalType().GetName())
+
+		self.slot_ptr_t = get_slot_ptr_type(key)
 
-		for index in range(0, node_handle_base.GetNumberOfMemberFunctions()):
-			func = node_handle_base.GetMemberFunctionAtIndex(index)
+		if self.slot_ptr_t is None:
+			for index in range(0, node_handle_base.GetNumberOfMemberFunctions()):
+				func = node_handle_base.GetMemberFunctionAtIndex(index)
 
-			if func.GetName() == "slot":
-				self.slot_ptr_t = func.GetReturnType()
-				break
+				if func.GetName() == "slot":
+					self.slot_ptr_t = func.GetReturnType()
+					break
+
+			_slot_ptr_types[key] = self.slot_ptr_t
 
 		# Determining the container type is possible from the policy of the containing class
 		typename = node_handle_base.GetCanonicalType().GetUnqualifiedType().GetName()
-		match = re.search(r"::(Node|Flat)Hash(Map|Set)Policy<", typename)
+		self.is_flat, self.is_map = get_policy_kind(typename)
 
-		self.is_flat = match.group(1) == 'Flat'
-		self.is_map = match.group(2) == 'Map'
+	def is_engaged(self):
+		# Test the flag of the optional directly, instantiating its synthetic is much more
+		#  expensive than reading a single bool
+		allocator = self.valobj.GetChildMemberWithName('alloc_').GetNonSyntheticValue()
+		allocator_t = allocator.GetType()
+		allocator_name = allocator_t.GetCanonicalType().GetName()
 
-	def get(self):
-		allocator = self.valobj.GetChildMemberWithName('alloc_')
-		allocator.SetPreferSyntheticValue(True)
+		if allocator_name not in _engaged_flag_paths:
+			_engaged_flag_paths[allocator_name] = find_engaged_flag_path(allocator_t)
+
+		path = _engaged_flag_paths[allocator_name]
+
+		if path is None:
+			# Unknown optional implementation, ask its synthetic instead
+			allocator = self.valobj.GetChildMemberWithName('alloc_')
+			allocator.SetPreferSyntheticValue(True)
 
-		assert(allocator.IsSynthetic())
+			assert(allocator.IsSynthetic())
 
-		if allocator.GetNumChildren() == 0:
+			return allocator.GetNumChildren() != 0
+
+		flag = allocator
+
+		# Lookups by name find the members of base classes too
+		for name in path:
+			flag = flag.GetChildMemberWithName(name)
+
+		return flag.GetValueAsUnsigned() != 0
+
+	def get(self):
+		if not self.is_engaged():
 			return None
 
 		slot = self.valobj.GetChildMemberWithName('slot_space_').AddressOf().Cast(self.slot_ptr_t).Dereference()
@@ -172,9 +540,12 @@ class AbseilHashContainerNodeValue(Value):
 
 @Synthetic
 class AbseilHashContainerSynthetic(SyntheticAdapter):
+	__slots__ = ()
+
 	category = "abseil"
+	provides_summary = True
 	recognizers = [
-		lldb.SBTypeNameSpecifier("^absl::[^:]+::(flat|node)_hash_(set|map)<.+> >$", True),
+		lldb.SBTypeNameSpecifier("^absl::[^:]+::(flat|node)_hash_(set|map)<.+> ?>$", True),
 	]
 
 	def __init__(self, valobj, dict):
@@ -187,9 +558,11 @@ class AbseilHashContainerSynthetic(SyntheticAdapter):
 
 @Synthetic
 class AbseilHashContainerIteratorSynthetic(SyntheticAdapter):
+	__slots__ = ()
+
 	category = "abseil"
 	recognizers = [
-		lldb.SBTypeNameSpecifier("^absl::[^:]+::container_internal::raw_hash_set<.+> >::(const_)?iterator$", True)
+		lldb.SBTypeNameSpecifier("^absl::[^:]+::container_internal::raw_hash_set<.+> ?>::(const_)?iterator$", True)
 	]
 
 	def __init__(self, valobj, dict):
@@ -197,9 +570,11 @@ class AbseilHashContainerIteratorSynthetic(SyntheticAdapter):
 
 @Synthetic
 class AbseilHashContainerNodeSynthetic(SyntheticAdapter):
+	__slots__ = ()
+
 	category = "abseil"
 	recognizers = [
-		lldb.SBTypeNameSpecifier("^absl::[^:]+::container_internal::raw_hash_set<.+> >::node_type$", True),
+		lldb.SBTypeNameSpecifier("^absl::[^:]+::container_internal::raw_hash_set<.+> ?>::node_type$", True),
 		lldb.SBTypeNameSpecifier("^absl::[^:]+::container_internal::node_handle<absl::[^:]+::container_internal::(Flat|Node)Hash(Map|Set)Policy", True),
 	]
 
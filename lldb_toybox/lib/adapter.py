@@ -1,5 +1,11 @@
 
 class SyntheticAdapter:
+	__slots__ = ('wrapped',)
+
+	# Whether the summary of the adapted value is worth a callout into Python for every
+	#  row displayed. Deployed synthetics opt into having theirs registered
+	provides_summary = False
+
 	def __init__(self, wrapped):
 		self.wrapped = wrapped
 
@@ -3,9 +3,23 @@ from lldb_toybox.lib.utils import *
 
 import lldb
 
+import os
+
+# Frontends only ever display the first few children of a container, but creating millions
+#  of them makes expanding huge containers unbearably slow. Only offer this many children,
+#  the summary still reports the real size
+MAX_CHILDREN = 4096
+
+try:
+	MAX_CHILDREN = max(1, int(os.environ.get('LLDB_TOYBOX_MAX_CHILDREN', MAX_CHILDREN)))
+except ValueError:
+	pass
+
 class IterableContainer:
 	"""Interface class describing required functionality for use with IterableContainerSyntheric"""
 
+	__slots__ = ()
+
 	def update(self):
 		return
 
@@ -18,12 +32,26 @@ class IterableContainer:
 	def get_summary(self):
 		return f"size={self.get_size()}"
 
-	def iterator(self):
+	def get_cache_key(self):
+		return None
+
+	def collect(self, limit):
+		"""Returns a list of at most `limit` elements of the container"""
+		return []
+
+	def collect_addresses(self, limit):
+		"""
+			Optionally returns the load addresses of at most `limit` elements, along
+			 with the value of the first one to create the others from. Returns None
+			 if the elements can only be obtained through `collect`
+		"""
 		return None
 
 class IterableContainerSynthetic:
 	"""Implementation of the LLDB SyntheticChildrenProvider for IterableContainers"""
 
+	__slots__ = ('container', 'rename_children', 'error', 'validated', 'size', 'cached_children')
+
 	def __init__(self, container, rename_children=True):
 		self.container = container
 		self.rename_children = rename_children
@@ -32,65 +60,107 @@ class IterableContainerSynthetic:
 
 	def update(self):
 		self.error = None
+		self.validated = False
 		self.size = None
-		self.iterator = None
 		self.cached_children = None
 
 		# Let underlying container update if it is stateful
 		self.container.update()
 
-		# Offer ability to opt-out of calling the iterator if the container appears invalid
-		self.error = self.container.validate()
+	def get_error(self):
+		# Offer ability to opt-out of calling the iterator if the container appears invalid. LLDB
+		#  updates every live synthetic on each stop, only validate once we are actually shown
+		if not self.validated:
+			self.error = self.container.validate()
+			self.validated = True
 
-	def has_children(self):
-		return self.error is None
+		return self.error
 
-	def num_children(self):
-		if self.error:
-			return 0
+	def has_children(self):
+		return self.get_error() is None
 
+	def get_size(self):
 		if not self.size:
 			self.size = self.container.get_size()
 
 		return self.size
 
+	def num_children(self):
+		if self.get_error():
+			return 0
+
+		return min(self.get_size(), MAX_CHILDREN)
+
+	def get_children(self):
+		if self.get_error():
+			return []
+
+		# LLDB asks for the children in order anyways, so collect all of them on the first
+		#  request. Never produce more children than we offer though
+		if self.cached_children is None:
+			self.cached_children = self.container.collect(self.num_children())
+
+			if self.rename_children and self.cached_children:
+				# Elements of a container all share the same type
+				child_t = self.cached_children[0].GetType()
+
+				self.cached_children = [rename_valobj(child, f"[{child_index}]", child_t) for child_index, child in enumerate(self.cached_children)]
+
+		return self.cached_children
+
 	def get_child_at_index(self, index):
-		if self.error:
+		if index < 0 or index >= MAX_CHILDREN:
 			return None
 
-		if index < 0:
+		children = self.get_children()
+
+		if index >= len(children):
 			return None
 
-		cached = 0
+		return children[index]
 
-		if self.cached_children is not None:
-			cached = len(self.cached_children)
-		else:
-			self.cached_children = list()
-			self.iterator = self.container.iterator()
+	def get_child_addresses(self):
+		if self.get_error():
+			return None
+
+		# Addresses are cheap compared to values, offer all of them. Adapters reordering the
+		#  children can then pick the first few of the whole container, not of an arbitrary part
+		return self.container.collect_addresses(self.get_size())
 
-		if cached <= index and self.iterator is not None:
-			try:
-				child = next(self.iterator)
+	def get_child_index(self, name):
+		if self.get_error() or not self.rename_children:
+			return None
 
-				if self.rename_children:
-					child = rename_valobj(child, f"[{cached}]")
+		# Children are named by their index, no need to look through them
+		if not name.startswith('[') or not name.endswith(']'):
+			return None
 
-				self.cached_children.append(child)
-				cached += 1
-			except StopIteration:
-				self.iterator = None
+		try:
+			index = int(name[1:-1])
+		except ValueError:
+			return None
 
-		if cached < index:
+		if index < 0 or index >= self.num_children():
 			return None
 
-		return self.cached_children[index]
+		return index
 
-	def get_child_index(self, name):
-		return None
+	def get_cache_key(self):
+		if self.get_error():
+			return None
+
+		return self.container.get_cache_key()
 
 	def get_summary(self):
-		if self.error:
-			return f"<Error: {self.error}>"
+		error = self.get_error()
+
+		if error:
+			return f"<Error: {error}>"
+
+		summary = self.container.get_summary()
+
+		# Make it obvious that not every element is offered as a child
+		if self.get_size() > MAX_CHILDREN:
+			summary += f" (showing first {MAX_CHILDREN})"
 
-		return self.container.get_summary()
+		return summary
@@ -7,8 +7,11 @@ import lldb
 import math
 
 class PagingSyntheticAdapter(SyntheticAdapter):
+	__slots__ = ('valobj', 'limits', 'total', 'levels', 'capacities')
 
 	class Pager:
+		__slots__ = ('root', 'level', 'offset')
+
 		def __init__(self, root, level, offset):
 			self.root = root
 			self.level = level
@@ -31,6 +34,7 @@ class PagingSyntheticAdapter(SyntheticAdapter):
 
 		self.total = 0
 		self.levels = 0
+		self.capacities = [1]
 
 		self.update()
 
@@ -38,12 +42,7 @@ class PagingSyntheticAdapter(SyntheticAdapter):
 		if depth < 0:
 			return self.total
 
-		capacity = 1
-
-		for limit in self.limits[:self.levels - depth]:
-			capacity *= limit
-
-		return capacity
+		return self.capacities[depth]
 
 	def pager_num_children(self, depth, offset):
 		contains = min(self.total - offset, self.pager_capacity(depth - 1))
@@ -51,7 +50,7 @@ class PagingSyntheticAdapter(SyntheticAdapter):
 		if self.levels == depth:
 			return contains
 
-		return math.ceil(contains / self.pager_capacity(depth))
+		return -(-contains // self.pager_capacity(depth))
 
 	def pager_get_child_at_index(self, depth, offset, index):
 		if self.levels <= depth:
@@ -67,7 +66,13 @@ class PagingSyntheticAdapter(SyntheticAdapter):
 	def update(self):
 		self.wrapped.update()
 
-		self.total = self.wrapped.num_children()
+		total = self.wrapped.num_children()
+
+		# The layout of the pagers only depends on the total, keep it if that did not change
+		if total == self.total:
+			return
+
+		self.total = total
 
 		# Determine how many levels of paginators we need to fit
 		#  within the per-level child count tresholds
@@ -78,11 +83,14 @@ class PagingSyntheticAdapter(SyntheticAdapter):
 			if remain <= limit:
 				break
 
-			remain = math.ceil(remain / limit)
+			remain = -(-remain // limit)
 			levels += 1
 
 		self.levels = levels
 
+		# Number of elements a single pager holds on each level
+		self.capacities = [math.prod(self.limits[:levels - depth]) for depth in range(0, levels + 1)]
+
 	def has_children(self):
 		return True
 
@@ -1,4 +1,6 @@
 
+from lldb_toybox.lib.utils import get_stop_scoped_key
+
 import lldb
 
 import argparse
@@ -8,6 +10,11 @@ import shlex
 _synthetics = list()
 _initializers = list()
 
+# Summaries are requested for every rendered row, and would construct a fresh provider
+#  each time. Remember them for as long as the process stays stopped
+_summaries = dict()
+_summaries_limit = 256
+
 _main_parser = argparse.ArgumentParser(
 	prog='toybox',
 	description='''
@@ -36,6 +43,9 @@ def Synthetic(clazz):
 def deploy(debugger):
 	deploy_main_command(debugger)
 
+	# Class names already deployed per category, in case the scripts are imported again
+	deployed = dict()
+
 	for clazz in _synthetics:
 		category_name = f'lldb-toybox.{clazz.category}'
 		category = debugger.GetCategory(category_name)
@@ -45,7 +55,10 @@ def deploy(debugger):
 			category.AddLanguage(lldb.eLanguageTypeC_plus_plus)
 			category.SetEnabled(True)
 
-		deploy_synthetic(category, clazz)
+		if category_name not in deployed:
+			deployed[category_name] = {synth.GetData() for synth in category.get_synthetics_array()}
+
+		deploy_synthetic(category, clazz, deployed[category_name])
 
 
 def deploy_main_command(debugger):
@@ -65,12 +78,35 @@ def deploy_main_command(debugger):
 	debugger.HandleCommand('command script add -o -f {}.main_command toybox'.format(__name__))
 
 
-def deploy_synthetic(category, clazz):
+def summarize(clazz, valobj, internal_dict):
+	valobj = valobj.GetNonSyntheticValue()
+
+	# Values without a load address can not be told apart by the key
+	if valobj.GetLoadAddress() == lldb.LLDB_INVALID_ADDRESS:
+		return clazz(valobj, internal_dict).get_summary()
+
+	key = (clazz, get_stop_scoped_key(valobj))
+	summary = _summaries.get(key)
+
+	if summary is None:
+		summary = clazz(valobj, internal_dict).get_summary()
+
+		# Keys of previous stops can never be hit again, drop them eventually
+		if len(_summaries) >= _summaries_limit:
+			_summaries.clear()
+
+		_summaries[key] = summary
+
+	return summary
+
+
+def deploy_synthetic(category, clazz, deployed):
 	class_name = f"{clazz.__module__}.{clazz.__qualname__}"
 
-	for synth in category.get_synthetics_array():
-		if class_name in str(synth):
-			return
+	if class_name in deployed:
+		return
+
+	deployed.add(class_name)
 
 	options = lldb.eTypeOptionNone
 	options |= lldb.eTypeOptionCascade
@@ -79,11 +115,16 @@ def deploy_synthetic(category, clazz):
 	synthetic = lldb.SBTypeSynthetic.CreateWithClassName(class_name)
 	synthetic.SetOptions(options)
 
-	summary = lldb.SBTypeSummary.CreateWithScriptCode(f'''
-		return {class_name}(valobj.GetNonSyntheticValue(), internal_dict).get_summary()
-	''')
-	summary.SetOptions(options)
+	summary = None
+
+	if clazz.provides_summary:
+		summary = lldb.SBTypeSummary.CreateWithScriptCode(f'''
+			return {__name__}.summarize({class_name}, valobj, internal_dict)
+		''')
+		summary.SetOptions(options)
 
 	for recognizer in clazz.recognizers:
 		category.AddTypeSynthetic(recognizer, synthetic)
-		category.AddTypeSummary(recognizer, summary)
+
+		if summary is not None:
+			category.AddTypeSummary(recognizer, summary)
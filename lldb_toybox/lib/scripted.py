@@ -4,37 +4,58 @@ from lldb_toybox.lib.adapter import SyntheticAdapter
 import lldb
 
 _scripted_t = None
-_scripted_stack = []
+
+# Backend of the scripted value currently being created. LLDB instantiates the synthetic
+#  as soon as the new value is queried for it, which is when it gets picked up from here
+_scripted_backend = None
 
 class ScriptedSynthetic(SyntheticAdapter):
+	__slots__ = ('valobj',)
+
 	def __init__(self, valobj, dict):
-		super().__init__(None)
+		super().__init__(_scripted_backend)
 
 		self.valobj = valobj
 
-		global _scripted_t
-		global _scripted_stack
+def init_scripted_type(valobj):
+	"""
+		Declares the type backing scripted values. This takes an expression evaluation,
+		 which is only remembered once it succeeded
+	"""
+	global _scripted_t
+
+	if _scripted_t is not None:
+		return
 
-		_scripted_stack.append(self)
+	scripted_t = valobj.EvaluateExpression('struct $lldb_toybox; ($lldb_toybox*) 0').GetType().GetPointeeType()
+
+	if not scripted_t.IsValid():
+		return
+
+	_scripted_t = scripted_t
+
+	valobj.GetTarget().GetDebugger().GetDefaultCategory().AddTypeSynthetic(
+		lldb.SBTypeNameSpecifier(_scripted_t.GetName()),
+		lldb.SBTypeSynthetic.CreateWithClassName(f'{__name__}.ScriptedSynthetic')
+	)
 
 def create_scripted_value(valobj, name, backend):
-	global _scripted_t
-	global _scripted_stack
+	global _scripted_backend
 
-	target = valobj.GetTarget()
+	init_scripted_type(valobj)
 
+	# Try again with the next value if the type could not be declared
 	if _scripted_t is None:
-		_scripted_t = valobj.EvaluateExpression('struct $lldb_toybox; ($lldb_toybox*) 0').GetType().GetPointeeType()
+		return lldb.SBValue()
 
-		target.GetDebugger().GetDefaultCategory().AddTypeSynthetic(
-			lldb.SBTypeNameSpecifier(_scripted_t.GetName()),
-			lldb.SBTypeSynthetic.CreateWithClassName(f'{__name__}.ScriptedSynthetic')
-		)
+	valobj = valobj.GetTarget().CreateValueFromData(name, lldb.SBData.CreateDataFromInt(0), _scripted_t)
 
-	valobj = target.CreateValueFromData(name, lldb.SBData.CreateDataFromInt(0), _scripted_t)
-	valobj.IsSynthetic()
+	# Querying the synthetic state forces LLDB to instantiate it
+	_scripted_backend = backend
 
-	synthetic = _scripted_stack.pop()
-	synthetic.wrapped = backend
+	try:
+		valobj.IsSynthetic()
+	finally:
+		_scripted_backend = None
 
 	return valobj
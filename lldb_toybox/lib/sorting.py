@@ -4,23 +4,112 @@ from lldb_toybox.lib.utils import *
 
 import lldb
 
-def try_extract_natural_index(valobj):
+import struct
+
+from operator import itemgetter
+
+# Containers are often presented multiple times during the same stop, and LLDB (or
+#  the IDE on top of it) is happy to create fresh synthetic providers every time. Keep
+#  the populated children around, keyed by a stop scoped identity of the container
+_populate_cache = dict()
+_populate_cache_limit = 64
+
+# Whether (and how) a natural index can be extracted only depends on the type of the
+#  key, remember the decision per process and typename
+_natural_index_extractors = dict()
+
+_UNSIGNED_BASIC_TYPES = frozenset((lldb.eBasicTypeUnsignedInt, lldb.eBasicTypeUnsignedLong, lldb.eBasicTypeUnsignedLongLong))
+_SIGNED_BASIC_TYPES = frozenset((lldb.eBasicTypeInt, lldb.eBasicTypeLong, lldb.eBasicTypeLongLong))
+
+# Integer keys can be decoded from a single read of the memory spanning all of them,
+#  as long as that memory is not too sparse
+_SIGNED_FORMATS = {4: 'i', 8: 'q'}
+
+_bulk_read_bytes_per_child = 256
+_bulk_read_limit = 4 << 20
+
+def get_natural_index_extractor(valobj):
+	"""
+		Returns a function extracting the natural index of values with the same type
+		 as `valobj`, or None if values of this type have no natural index
+	"""
+	key = get_type_scoped_key(valobj, valobj.GetType().GetName())
+
+	if key in _natural_index_extractors:
+		return _natural_index_extractors[key]
+
 	# Drilldown into trivial types
-	if valobj.GetType().GetNumberOfFields() == 1:
+	drilldown = valobj.GetType().GetNumberOfFields() == 1
+
+	if drilldown:
 		valobj = valobj.GetChildAtIndex(0)
 
 	# Try converting the valobj into a simple integral value
 	basic = valobj.GetType().GetCanonicalType().GetBasicType()
+	extractor = None
+
+	if basic in _UNSIGNED_BASIC_TYPES:
+		extractor = lldb.SBValue.GetValueAsUnsigned
+
+	if basic in _SIGNED_BASIC_TYPES:
+		extractor = lldb.SBValue.GetValueAsSigned
+
+	if extractor and drilldown:
+		extract_inner = extractor
+		extractor = lambda valobj: extract_inner(valobj.GetChildAtIndex(0))
 
-	if basic in (lldb.eBasicTypeUnsignedInt, lldb.eBasicTypeUnsignedLong, lldb.eBasicTypeUnsignedLongLong):
-		return valobj.GetValueAsUnsigned()
+	_natural_index_extractors[key] = extractor
 
-	if basic in (lldb.eBasicTypeInt, lldb.eBasicTypeLong, lldb.eBasicTypeLongLong):
-		return valobj.GetValueAsSigned()
+	return extractor
 
-	return None
+def read_natural_indices(key, base, addresses):
+	"""
+		Decodes the natural indices of all children with a single memory read, given
+		 the key of the child at `base`, and the addresses of all children. Returns
+		 None if the keys are not plain integers, or are too far apart
+	"""
+	index_value = key
+
+	# Same drilldown as for the extractors
+	if index_value.GetType().GetNumberOfFields() == 1:
+		index_value = index_value.GetChildAtIndex(0)
+
+	basic = index_value.GetType().GetCanonicalType().GetBasicType()
+	size = index_value.GetByteSize()
+
+	if size not in _SIGNED_FORMATS:
+		return None
+
+	if basic in _SIGNED_BASIC_TYPES:
+		fmt = _SIGNED_FORMATS[size]
+	elif basic in _UNSIGNED_BASIC_TYPES:
+		fmt = _SIGNED_FORMATS[size].upper()
+	else:
+		return None
+
+	key_offset = index_value.GetLoadAddress() - base
+
+	start = min(addresses) + key_offset
+	length = max(addresses) + key_offset + size - start
+
+	if length > min(_bulk_read_limit, len(addresses) * _bulk_read_bytes_per_child):
+		return None
+
+	process = key.GetProcess()
+	error = lldb.SBError()
+	data = process.ReadMemory(start, length, error)
+
+	if error.Fail():
+		return None
+
+	order = '>' if process.GetByteOrder() == lldb.eByteOrderBig else '<'
+	unpack = struct.Struct(order + fmt).unpack_from
+
+	return [unpack(data, address + key_offset - start)[0] for address in addresses]
 
 class SortingSyntheticAdapter(SyntheticAdapter):
+	__slots__ = ('is_map', 'children', 'child_indices', 'factory')
+
 	def __init__(self, wrapped, is_map):
 		super().__init__(wrapped)
 
@@ -28,50 +117,144 @@ class SortingSyntheticAdapter(SyntheticAdapter):
 
 	def update(self):
 		self.children = None
+		self.child_indices = None
+		self.factory = None
 
 		self.wrapped.update()
 
+	def num_children(self):
+		# The count is known without ordering anything, only populate once a child is requested
+		return self.wrapped.num_children()
+
+	def get_key(self, child):
+		return child.GetChildMemberWithName('first') if self.is_map else child
+
 	def populate(self):
 		if self.children is not None:
 			return
 
+		cache_key = self.wrapped.get_cache_key()
+
+		if cache_key is not None:
+			cached = _populate_cache.get(cache_key)
+
+			if cached is not None:
+				self.children, self.factory = cached
+				return
+
+		# Children are only recorded as (name, address, type) entries here, the values
+		#  themselves are created on demand once LLDB asks for a particular index
 		child_list = list()
-		child_map = dict()
 
-		# Iterate over map hashtable via provided generator
-		for iter_index in range(0, self.wrapped.num_children()):
-			child = self.wrapped.get_child_at_index(iter_index)
+		num_children = self.wrapped.num_children()
+
+		if num_children == 0:
+			self.children = child_list
+			return
+
+		# Where the children are located is often known without creating them, any
+		#  of them can serve to create the renamed values later on
+		known_children = self.wrapped.get_child_addresses()
+
+		if known_children is not None:
+			addresses, self.factory = known_children
+		else:
+			children = self.wrapped.get_children()
+
+			# Broken containers may yield fewer elements than their size claims, if any
+			if not children:
+				self.children = child_list
+				return
+
+			self.factory = children[0]
+			addresses = [child.GetLoadAddress() for child in children]
+
+		# Iteration based order is often not that useful during debugging, try
+		#  to extract a more natural index to order by. All keys share the same
+		#  type, so the first one tells whether that is possible at all
+		key = self.get_key(self.factory)
+		extractor = get_natural_index_extractor(key)
+
+		if extractor is None:
+			# Nothing better to go by, iteration index will have to suffice. Children share
+			#  the same type, so only their addresses have to be collected
+			child_t = self.factory.GetType()
+
+			child_list = [(f'[{iter_index}]', address, child_t) for iter_index, address in enumerate(addresses[:num_children])]
+		else:
+			shown = self.factory
 
-			# Iteration based order is often not that useful during debugging, try
-			#  to extract a more natural index to order by
-			key = self.is_map and child.GetChildMemberWithName('first') or child
+			# Since we are ordering by natural_index, it makes sense to give some
+			#  additional prefix describing the typename of the ID
+			prefix = key.GetType().GetUnqualifiedType().GetName()
 
-			natural_index = try_extract_natural_index(key)
+			if self.is_map:
+				# If the key has no synthetic its natural_index is likely a full
+				#  representation, show only the mapped value to the user
+				if not key.IsSynthetic():
+					shown = shown.GetChildMemberWithName('second')
 
-			if natural_index is None:
-				# Nothing better to go by, iteration index will have to suffice
-				child_list.append(rename_valobj(child, f'[{iter_index}]'))
-			else:
-				# Since we are ordering by natural_index, it makes sense to give some
-				#  additional prefix describing the typename of the ID
-				prefix = key.GetType().GetUnqualifiedType().GetName()
+			# Children share their layout, so what is shown of them can be located with
+			#  the offset measured on the first one
+			base = self.factory.GetLoadAddress()
 
-				if self.is_map:
-					# If the key has no synthetic its natural_index is likely a full
-					#  representation, show only the mapped value to the user
-					if not key.IsSynthetic():
-						child = child.GetChildMemberWithName('second')
+			shown_offset = shown.GetLoadAddress() - base
+			shown_t = shown.GetType()
 
-				# Store the child by it's natural index
-				child_map[(natural_index, child.GetLoadAddress())] = rename_valobj(child, f'{prefix}({natural_index})')
+			# Integer keys are best decoded from memory directly, fall back to going
+			#  through the SB API key by key if that is not possible
+			natural_indices = read_natural_indices(key, base, addresses)
 
-		# Flush delayed natural index based children
-		for (index, addr), child in sorted(child_map.items()):
-			child_list.append(child)
+			if natural_indices is None:
+				# Keys are too slow to extract one by one for every element of huge containers,
+				#  settle for ordering the offered ones then
+				addresses = addresses[:num_children]
+
+				# The children are all known by address, create their values right there
+				create_value = self.factory.CreateValueFromAddress
+				child_t = self.factory.GetType()
+
+				natural_indices = [extractor(self.get_key(create_value('key', address, child_t))) for address in addresses]
+
+			# Store the children by their natural index
+			natural_list = [
+				(natural_index, (f'{prefix}({natural_index})', address + shown_offset, shown_t))
+				for natural_index, address in zip(natural_indices, addresses)
+			]
+
+			# Flush natural index based children, the sort is stable so equal keys
+			#  (of multimaps/multisets) keep their iteration order
+			natural_list.sort(key=itemgetter(0))
+			child_list.extend(map(itemgetter(1), natural_list[:num_children]))
 
 		self.children = child_list
 
+		if cache_key is not None:
+			# Keys of previous stops can never be hit again, drop them eventually
+			if len(_populate_cache) >= _populate_cache_limit:
+				_populate_cache.clear()
+
+			_populate_cache[cache_key] = (child_list, self.factory)
+
 	def get_child_at_index(self, index):
 		self.populate()
 
-		return self.children[index]
+		if index < 0 or index >= len(self.children):
+			return None
+
+		name, address, child_t = self.children[index]
+
+		return self.factory.CreateValueFromAddress(name, address, child_t)
+
+	def get_child_index(self, name):
+		self.populate()
+
+		# Names are only needed for lookups like `container[42]`, index them on the first one. Equal
+		#  keys of multimaps/multisets share a name, LLDB resolves those to the first child
+		if self.child_indices is None:
+			self.child_indices = dict()
+
+			for index, child in enumerate(self.children):
+				self.child_indices.setdefault(child[0], index)
+
+		return self.child_indices.get(name)
@@ -1,11 +1,41 @@
 
 import lldb
 
-def make_array_from_pointer(valobj, size, raw_pointer_type=None):
-	raw_pointer_type = raw_pointer_type or valobj.GetType()
-	array_pointer_t = raw_pointer_type.GetPointeeType().GetArrayType(size).GetPointerType()
+import functools
 
-	return valobj.Cast(array_pointer_t).Dereference()
+class PointerArray:
+	"""
+		Indexable view of the elements a pointer points to. Elements are created
+		 directly from their address, so no (potentially huge) array type has to
+		 be materialized to access them
+	"""
+
+	__slots__ = ('valobj', 'address', 'element_t', 'stride')
+
+	def __init__(self, valobj, raw_pointer_type=None):
+		raw_pointer_type = raw_pointer_type or valobj.GetType()
+
+		self.valobj = valobj
+		self.address = valobj.GetValueAsUnsigned()
+		self.element_t = raw_pointer_type.GetPointeeType()
+		self.stride = self.element_t.GetByteSize()
+
+	def address_of(self, index):
+		return self.address + index * self.stride
+
+	def __getitem__(self, index):
+		return self.valobj.CreateValueFromAddress(f'[{index}]', self.address_of(index), self.element_t)
+
+def get_type_scoped_key(valobj, typename):
+	"""
+		Returns a key for remembering information about the type named `typename`, as
+		 seen by `valobj`. Equally named types may differ between processes, and are
+		 replaced when the program is rebuilt and ran again
+	"""
+	return (valobj.GetProcess().GetUniqueID(), typename)
+
+# The canonical form only depends on the type, remember it per process and typename
+_canonical_targets = dict()
 
 def canonize_synthetic_valobj(valobj):
 	"""
@@ -17,35 +47,125 @@ def canonize_synthetic_valobj(valobj):
 		 the received valobj, including pointers, references, and unnecessary 
 		 typedefs
 	"""
-	target_type = valobj.GetType()
+	source_type = valobj.GetType()
+	key = get_type_scoped_key(valobj, source_type.GetName())
 
-	if target_type.IsPointerType() or target_type.IsReferenceType():
-		valobj = valobj.Dereference().GetNonSyntheticValue()
+	entry = _canonical_targets.get(key)
+
+	# Types of unloaded modules become invalid, find out where the new ones lead
+	if entry is None or not entry[1].IsValid():
+		is_indirect = source_type.IsPointerType() or source_type.IsReferenceType()
+
+		if is_indirect:
+			source_type = source_type.GetPointeeType() if source_type.IsPointerType() else source_type.GetDereferencedType()
+
+		entry = (is_indirect, source_type.GetCanonicalType().GetUnqualifiedType())
+
+		_canonical_targets[key] = entry
 
-	target_type = valobj.GetType().GetCanonicalType().GetUnqualifiedType()
+	is_indirect, target_type = entry
+
+	if is_indirect:
+		valobj = valobj.Dereference().GetNonSyntheticValue()
 
 	return valobj.Cast(target_type)
 
+# Typedef chains only depend on the type, remember where they lead per process, typename
+#  and depth
+_typedef_targets = dict()
+
 def remove_typedef(valobj, levels=1):
-	target_type = valobj.GetType()
+	source_type = valobj.GetType()
+	key = (get_type_scoped_key(valobj, source_type.GetName()), levels)
+
+	target_type = _typedef_targets.get(key)
+
+	# Types of unloaded modules become invalid, follow the chain of the new ones
+	if target_type is None or not target_type.IsValid():
+		target_type = source_type
 
-	for _ in range(0, levels):
-		target_type = target_type.GetTypedefedType()
+		for _ in range(0, levels):
+			target_type = target_type.GetTypedefedType()
+
+		_typedef_targets[key] = target_type
 
 	return valobj.Cast(target_type)
 
-def rename_valobj(valobj, name):
-	return valobj.CreateValueFromAddress(name, valobj.GetLoadAddress(), valobj.GetType())
+# Newer LLDB versions can rename a value directly, without creating it from scratch
+_can_clone_valobj = hasattr(lldb.SBValue, 'Clone')
+
+def rename_valobj(valobj, name, valobj_t=None):
+	if valobj.GetName() == name:
+		return valobj
+
+	if _can_clone_valobj:
+		cloned = valobj.Clone(name)
+
+		if cloned.IsValid():
+			return cloned
+
+	# Callers renaming many values of the same type can pass it in, saving a lookup per value
+	valobj_t = valobj_t or valobj.GetType()
+
+	# Members can be recreated from the data of their parent under a different name,
+	#  which works without a load address, and does not read the process memory again.
+	#  Dereferenced values have a pointer/reference parent that does not hold their data
+	parent = valobj.GetParent()
+
+	if parent.IsValid():
+		parent_t = parent.GetType()
+
+		if not parent_t.IsPointerType() and not parent_t.IsReferenceType():
+			return parent.CreateChildAtOffset(name, valobj.GetByteOffset(), valobj_t)
+
+	return valobj.CreateValueFromAddress(name, valobj.GetLoadAddress(), valobj_t)
+
+def get_stop_scoped_key(valobj):
+	"""
+		Returns a key identifying the value for as long as the process remains
+		 stopped. Expression evaluation resumes the process, so those stops are
+		 taken into account as well.
+	"""
+	process = valobj.GetProcess()
+
+	return (process.GetUniqueID(), process.GetStopID(True), valobj.GetLoadAddress(), valobj.GetType().GetName())
 
 def is_pow2(number):
-	return (number + 1) & number == 0
+	return number != 0 and number & (number - 1) == 0
 
+# Testing against these witnesses is deterministic for all 64 bit numbers
+_PRIME_WITNESSES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+
+# Sibling containers tend to have the same few bucket counts, remember the verdicts
+@functools.lru_cache(maxsize=256)
 def is_prime(number):
-	if number <= 1:
+	if number < 2:
 		return False
 
-	for divisor in range(2, int(number**0.5)+1):
-		if number % divisor == 0:
+	for witness in _PRIME_WITNESSES:
+		if number % witness == 0:
+			return number == witness
+
+	# Miller-Rabin, with number - 1 = d * 2^s
+	d = number - 1
+	s = 0
+
+	while d % 2 == 0:
+		d //= 2
+		s += 1
+
+	for witness in _PRIME_WITNESSES:
+		x = pow(witness, d, number)
+
+		if x == 1 or x == number - 1:
+			continue
+
+		for _ in range(1, s):
+			x = x * x % number
+
+			if x == number - 1:
+				break
+		else:
 			return False
 
 	return True
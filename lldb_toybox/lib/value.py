@@ -6,6 +6,8 @@ import lldb
 class Value:
 	"""Interface class describing required functionality for use with ValueContainerSynthetic"""
 
+	__slots__ = ()
+
 	def update(self):
 		return
 
@@ -21,6 +23,8 @@ class Value:
 class ValueSynthetic:
 	"""Implementation of the LLDB SyntheticChildrenProvider for Values"""
 
+	__slots__ = ('value', 'rename_to', 'error', 'content', 'content_set')
+
 	def __init__(self, value, rename_to=None):
 		self.value = value
 		self.rename_to = rename_to
@@ -46,7 +50,11 @@ class ValueSynthetic:
 		if not self.error:
 			content = self.value.get()
 
-			if content and self.rename_to:
+			# Settle validity once, so the content only needs to be tested against None later on
+			if content is not None and not content.IsValid():
+				content = None
+
+			if content is not None and self.rename_to:
 				content = rename_valobj(content, self.rename_to)
 
 			self.content = content
@@ -59,7 +67,7 @@ class ValueSynthetic:
 	def num_children(self):
 		self.populate()
 
-		return self.content and 1 or 0
+		return 1 if self.content is not None else 0
 
 	def get_child_at_index(self, index):
 		self.populate()
@@ -8,81 +8,221 @@ from lldb_toybox.lib.value import Value, ValueSynthetic
 
 import lldb
 
-import re
+# Offsets of the members of interest are the same for all nodes of the same type, remember
+#  them per process and node typename
+_node_layouts = dict()
+
+# The bucket count is buried deep inside the bucket list of the table, remember its
+#  (offset, size) within the container per process and typename instead of walking there
+#  each time
+_bucket_count_fields = dict()
 
 class LibCXXHashContainer(IterableContainer):
+	__slots__ = ('valobj', 'typename', 'is_map', 'first_node', 'node_t', 'size_value', 'size', 'bucket_count')
+
 	def __init__(self, valobj):
 		self.valobj = canonize_synthetic_valobj(valobj)
 
 		# This provider serves both unordered_set/map, as they are both backed by the same
-		#  hash table implementation, determine which variant we are
-		typename = self.valobj.GetType().GetCanonicalType().GetUnqualifiedType().GetName()
-		match = re.search(r"^std::[^:]+::unordered_(?:multi)?(map|set)", typename)
-
-		self.is_map = match.group(1) == 'map'
+		#  hash table implementation, determine which variant we are. Only the template name
+		#  is of interest, as the arguments may name other containers. The canonized value
+		#  already has the canonical, unqualified type
+		self.typename = self.valobj.GetType().GetName()
+		self.is_map = self.typename.partition('<')[0].endswith(('unordered_map', 'unordered_multimap'))
 
 	def update(self):
 		# https://github.com/apple/llvm-project/blob/next/libcxx/include/__hash_table
 		#   __compressed_pair<__first_node, __node_allocator>     __p1_;
 		#   __compressed_pair<size_type, hasher>                  __p2_;
-		self.table = self.valobj.GetChildMemberWithName("__table_");
+		table = self.valobj.GetChildMemberWithName("__table_");
+
+		# Resolve the members of interest once, instead of walking the member chains
+		#  every time one of them is read
+		self.first_node = table.GetChildMemberWithName("__p1_").GetChildAtIndex(0).GetChildMemberWithName("__value_")
+		self.node_t = self.first_node.GetType().GetTemplateArgumentType(0).GetPointeeType()
+
+		self.size_value = table.GetChildMemberWithName("__p2_").GetChildAtIndex(0).GetChildMemberWithName("__value_")
+
+		self.size = None
+		self.bucket_count = None
+
+	def find_bucket_count_value(self):
+		return self.valobj.GetChildMemberWithName("__table_") \
+			.GetChildMemberWithName('__bucket_list_')        \
+			.GetChildMemberWithName('__ptr_')                \
+			.GetChildAtIndex(1)                              \
+			.GetChildMemberWithName('__value_')              \
+			.GetChildMemberWithName('__data_')               \
+			.GetChildAtIndex(0)                              \
+			.GetChildMemberWithName('__value_')
+
+	def read_bucket_count(self):
+		address = self.valobj.GetLoadAddress()
+
+		if address == lldb.LLDB_INVALID_ADDRESS:
+			return self.find_bucket_count_value().GetValueAsUnsigned()
+
+		key = get_type_scoped_key(self.valobj, self.typename)
+		field = _bucket_count_fields.get(key)
+
+		if field is None:
+			value = self.find_bucket_count_value()
+			field = (value.GetLoadAddress() - address, value.GetByteSize())
+
+			_bucket_count_fields[key] = field
+
+		offset, size = field
+
+		error = lldb.SBError()
+		bucket_count = self.valobj.GetProcess().ReadUnsignedFromMemory(address + offset, size, error)
+
+		if error.Fail():
+			return self.find_bucket_count_value().GetValueAsUnsigned()
+
+		return bucket_count
 
 	def get_bucket_count(self):
-		return self.table.GetChildMemberWithName('__bucket_list_') \
-			.GetChildMemberWithName('__ptr_')                      \
-			.GetChildAtIndex(1)                                    \
-			.GetChildMemberWithName('__value_')                    \
-			.GetChildMemberWithName('__data_')                     \
-			.GetChildAtIndex(0)                                    \
-			.GetChildMemberWithName('__value_')                    \
-			.GetValueAsUnsigned()
+		if self.bucket_count is None:
+			self.bucket_count = self.read_bucket_count()
+
+		return self.bucket_count
 
 	def validate(self):
+		# Nothing is shown of empty tables, no need to look at their buckets
+		if self.get_size() == 0:
+			return
+
 		bucket_count = self.get_bucket_count()
 
-		if bucket_count != 0 and not is_pow2(bucket_count) and not is_prime(bucket_count):
+		# Tables holding elements always have buckets
+		if bucket_count == 0:
+			return f"Bucket count is zero despite size {self.get_size()}"
+
+		# Test the cheap case first, only resort to a primality test if it does not apply
+		if is_pow2(bucket_count):
+			return
+
+		if not is_prime(bucket_count):
 			return f"Bucket count {bucket_count} is neither pow2 nor prime"
 
 	def get_size(self):
-		return self.table.GetChildMemberWithName("__p2_").GetChildAtIndex(0).GetChildMemberWithName("__value_").GetValueAsUnsigned()
+		if self.size is None:
+			self.size = self.size_value.GetValueAsUnsigned()
 
-	def iterator(self):
-		first_node = self.table.GetChildMemberWithName("__p1_").GetChildAtIndex(0).GetChildMemberWithName("__value_")
-		node_type = first_node.GetType().GetTemplateArgumentType(0).GetPointeeType()
+		return self.size
 
-		next = first_node.GetChildMemberWithName("__next_")
+	def get_cache_key(self):
+		# Values without a load address all share the same key, never mix them up
+		if self.valobj.GetLoadAddress() == lldb.LLDB_INVALID_ADDRESS:
+			return None
+
+		return get_stop_scoped_key(self.valobj)
 
-		while next.GetValueAsUnsigned(0):
-			node = next.Dereference().Cast(node_type)
+	def get_node_layout(self, node):
+		"""
+			Returns the (next_offset, value_offset, value_t) layout of the nodes, these are
+			 the same for every node of the table
+		"""
+		node_addr = node.GetLoadAddress()
 
-			next = node.GetChildMemberWithName("__next_")
-			value = node.GetChildMemberWithName("__value_")
+		index = node.GetIndexOfChildWithName("__value_")
 
+		if index < node.GetNumChildren():
+			value = node.GetChildAtIndex(index)
+		else:
 			# Xcode 16 bug/quirk? __value_ is parsed as an union despite not being one?
-			if not value.IsValid():
-				value = node.GetChildAtIndex(2).GetChildMemberWithName("__value_")
+			value = node.GetChildAtIndex(2).GetChildMemberWithName("__value_")
+
+		if self.is_map:
+			value = value.GetChildMemberWithName("__cc_")
+			value_t = value.GetType()
+		else:
+			# By default `value` is of std::__hash_node<K, void*>::__node_type, which is
+			#  a little too verbose, reduce to K
+			value_t = value.GetType().GetTypedefedType()
+
+		next_offset = node.GetChildMemberWithName("__next_").GetLoadAddress() - node_addr
+		value_offset = value.GetLoadAddress() - node_addr
 
-			if self.is_map:
-				yield value.GetChildMemberWithName("__cc_")
-			else:
-				# By default `value` is of std::__hash_node<K, void*>::__node_type, which is
-				#  a little too verbose, reduce to K
-				yield remove_typedef(value)
+		return (next_offset, value_offset, value_t)
+
+	def find_values(self, limit):
+		"""Returns the addresses and the type of at most `limit` values stored in the table"""
+		if self.get_size() == 0:
+			return [], None
+
+		node_type = self.node_t
+		node_addr = self.first_node.GetChildMemberWithName("__next_").GetValueAsUnsigned(0)
+
+		if node_addr == 0:
+			return [], None
+
+		# Resolve the layout using the first node, values are then created right at their
+		#  offset instead of walking the members of every node
+		key = get_type_scoped_key(self.valobj, node_type.GetCanonicalType().GetName())
+		layout = _node_layouts.get(key)
+
+		# Types of unloaded modules become invalid, measure the new nodes again
+		if layout is None or not layout[2].IsValid():
+			layout = self.get_node_layout(self.valobj.CreateValueFromAddress("node", node_addr, node_type))
+
+			_node_layouts[key] = layout
+
+		next_offset, value_offset, value_t = layout
+
+		# Chase the list by reading the raw `__next_` pointers, so that values are only created
+		#  for the nodes themselves. Never follow more nodes than the table claims to hold
+		process = self.valobj.GetProcess()
+		error = lldb.SBError()
+
+		read_pointer = process.ReadPointerFromMemory
+
+		limit = min(limit, self.get_size())
+		node_addrs = list()
+
+		while node_addr != 0 and len(node_addrs) < limit:
+			node_addrs.append(node_addr)
+			node_addr = read_pointer(node_addr + next_offset, error)
+
+			if error.Fail():
+				break
+
+		return [node_addr + value_offset for node_addr in node_addrs], value_t
+
+	def collect(self, limit):
+		addresses, value_t = self.find_values(limit)
+		create_value = self.valobj.CreateValueFromAddress
+
+		return [create_value("value", address, value_t) for address in addresses]
+
+	def collect_addresses(self, limit):
+		addresses, value_t = self.find_values(limit)
+
+		if not addresses:
+			return None
+
+		return addresses, self.valobj.CreateValueFromAddress("value", addresses[0], value_t)
 
 class LibCXXHashContainerIterator(Value):
+	__slots__ = ('valobj', 'is_map', 'node_ptr_t')
+
 	def __init__(self, valobj):
 		self.valobj = canonize_synthetic_valobj(valobj)
 
 		# This provider serves both unordered_set/map, as they are both backed by the same
-		#  hash table implementation, determine which variant we are
-		self.is_map = re.search(r"std::[^:]+::__hash_const_iterator<", self.valobj.GetType().GetName()) is None
+		#  hash table implementation, determine which variant we are. Map iterators wrap
+		#  the iterators of the table, so only the outermost template name is of interest
+		iterator_t = self.valobj.GetType()
+
+		self.is_map = not iterator_t.GetName().partition('<')[0].endswith('__hash_const_iterator')
 
 		# Map iterators are hash iterators in disguise, rebind
 		if self.is_map:
 			self.valobj = valobj.GetChildMemberWithName('__i_')
+			iterator_t = self.valobj.GetType()
 
 		# Determine node pointer type stored by this handle
-		self.node_ptr_t = self.valobj.GetType().GetTemplateArgumentType(0)
+		self.node_ptr_t = iterator_t.GetTemplateArgumentType(0)
 
 	def get(self):
 		node_ptr = self.valobj.GetChildMemberWithName('__node_')
@@ -98,18 +238,19 @@ class LibCXXHashContainerIterator(Value):
 			return remove_typedef(node.GetChildMemberWithName('__value_'))
 
 class LibCXXHashContainerNode(Value):
+	__slots__ = ('valobj', 'node_ptr_t', 'is_map')
+
 	def __init__(self, valobj):
 		self.valobj = canonize_synthetic_valobj(valobj)
 
+		handle_t = self.valobj.GetType()
+
 		# Determine node pointer type stored by this handle
-		self.node_ptr_t = self.valobj.GetType().GetTemplateArgumentType(0).GetPointerType()
+		self.node_ptr_t = handle_t.GetTemplateArgumentType(0).GetPointerType()
 
 		# This provider serves both unordered_set/map, as they are both backed by the same
 		#  hash table implementation, determine which variant we are
-		typename = self.valobj.GetType().GetCanonicalType().GetUnqualifiedType().GetName()
-		match = re.search("::__(set|map)_node_handle_specifics>$", typename)
-
-		self.is_map = match.group(1) == 'map'
+		self.is_map = handle_t.GetName().endswith('::__map_node_handle_specifics>')
 
 	def get(self):
 		node_ptr = self.valobj.GetChildMemberWithName('__ptr_')
@@ -126,9 +267,12 @@ class LibCXXHashContainerNode(Value):
 
 @Synthetic
 class LibCXXHashContainerSynthetic(SyntheticAdapter):
+	__slots__ = ()
+
 	category = "libcxx-overrides"
+	provides_summary = True
 	recognizers = [
-		lldb.SBTypeNameSpecifier("^std::[^:]+::unordered_(multi)?(map|set)<.+> >$", True),
+		lldb.SBTypeNameSpecifier("^std::[^:]+::unordered_(multi)?(map|set)<.+> ?>$", True),
 	]
 
 	def __init__(self, valobj, dict):
@@ -141,10 +285,13 @@ class LibCXXHashContainerSynthetic(SyntheticAdapter):
 
 @Synthetic
 class LibCXXHashContainerIteratorSynthetic(SyntheticAdapter):
+	__slots__ = ()
+
 	category = "libcxx-overrides"
 	recognizers = [
-		lldb.SBTypeNameSpecifier("^std::[^:]+::unordered_(multi)?(set|map)<.+> >::(const_)?iterator$", True),
-		lldb.SBTypeNameSpecifier("^std::[^:]+::(__hash_map_iterator<std::[^:]+::__hash_iterator|__hash_const_iterator)<std::[^:]+::__hash_node<", True),		
+		lldb.SBTypeNameSpecifier("^std::[^:]+::unordered_(multi)?(set|map)<.+> ?>::(const_)?iterator$", True),
+		lldb.SBTypeNameSpecifier("^std::[^:]+::__hash_map_iterator<std::[^:]+::__hash_iterator<std::[^:]+::__hash_node<", True),
+		lldb.SBTypeNameSpecifier("^std::[^:]+::__hash_const_iterator<std::[^:]+::__hash_node<", True),
 	]
 
 	def __init__(self, valobj, dict):
@@ -152,9 +299,11 @@ class LibCXXHashContainerIteratorSynthetic(SyntheticAdapter):
 
 @Synthetic
 class LibCXXHashContainerNodeSynthetic(SyntheticAdapter):
+	__slots__ = ()
+
 	category = "libcxx"
 	recognizers = [
-		lldb.SBTypeNameSpecifier("^std::[^:]+::unordered_(multi)?(set|map)<.+> >::node_type$", True),
+		lldb.SBTypeNameSpecifier("^std::[^:]+::unordered_(multi)?(set|map)<.+> ?>::node_type$", True),
 		lldb.SBTypeNameSpecifier("^std::[^:]+::__basic_node_handle<std::[^:]+::__hash_node<", True),		
 	]
 